@@ -1,19 +1,70 @@
 import streamlit as st
 import time
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
 import streamlit.components.v1 as components
-import cohere
-import json
+try:
+    import orjson
+    json_dumps, json_loads = orjson.dumps, orjson.loads
+except ImportError:  # orjson is optional; fall back to the stdlib with the same bytes interface
+    import json
+
+    def json_dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+    json_loads = json.loads
+import mmap
 import os
 import uuid
 import hashlib
-from utils import get_document_text, get_chunked_text, get_faiss_index, search_faiss_index
+import html
+import itertools
+import threading
+from utils import (
+    CHUNK_OVERLAP, CHUNK_SIZE, DEFAULT_NPROBE, cache_answer, embed_query, get_chunks_hash,
+    get_cohere_client, get_faiss_index, iter_chunks, iter_document_text, lookup_cached_answer,
+    normalize_query, run_in_background, search_faiss_index, write_atomically
+)
 
 
 # Persistent storage for chat history with session isolation
 DATA_DIR = ".streamlit/data"
 SESSIONS_DIR = os.path.join(DATA_DIR, "sessions")
-CHAT_HISTORY_FILE_TEMPLATE = os.path.join(SESSIONS_DIR, "{session_id}", "chat_history.json")
+CHAT_HISTORY_FILE_TEMPLATE = os.path.join(SESSIONS_DIR, "{session_id}", "chat_history.jsonl")
+INDEX_CACHE_DIR = os.path.join(DATA_DIR, "faiss_cache")
+# The append-only history log is trimmed back to the last 10 conversations at most this often
+HISTORY_COMPACTION_INTERVAL = 24 * 60 * 60  # seconds
+# Old session folders are swept at most this often, tracked by a sentinel file's mtime
+SESSION_CLEANUP_INTERVAL = 60 * 60  # seconds
+CLEANUP_SENTINEL = os.path.join(DATA_DIR, ".last_cleanup")
+# Sessions whose parsed history is kept in memory at once
+HISTORY_CACHE_MAX_FILES = 256
+
+# Page stylesheet, inlined once per process (see load_page_css)
+CSS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "style.css")
+
+# Below this best-match cosine similarity the document is treated as not covering the question
+MIN_RELEVANCE_SCORE = 0.30
+NOT_IN_DOCUMENT_ANSWER = "This information is not available in the document."
+
+# RAG system prompt - optimized for aggressive summarization; sent as the chat preamble
+RAG_SYSTEM_PROMPT = (
+    "You are an expert document analyst. SUMMARIZE your answer in 2-3 sentences maximum. "
+    "Based on the provided context, extract ONLY the most essential facts that directly answer the question. "
+    "Use bullet points if listing multiple items. Avoid explanations, examples, or redundant information. "
+    "Maximum 100 tokens - be extremely concise. "
+    "If the answer is not found, say 'Not available in document.'"
+)
+
+# Conversations rendered per page in the history column; "Load older" reveals the next page
+HISTORY_PAGE_SIZE = 5
+
+
+@st.cache_resource
+def load_page_css():
+    """Read the page stylesheet once and return it as a <style> block."""
+    with open(CSS_FILE, 'r') as f:
+        return f"<style>\n{f.read()}</style>"
 
 def ensure_session():
     """Create or retrieve session ID for user."""
@@ -24,40 +75,144 @@ def ensure_session():
         os.makedirs(os.path.join(SESSIONS_DIR, session_id), exist_ok=True)
     return st.session_state['session_id']
 
+@st.cache_resource
 def ensure_data_dir():
-    """Create data directory if it doesn't exist."""
+    """Create data directory if it doesn't exist (once per process, like load_page_css)."""
     os.makedirs(SESSIONS_DIR, exist_ok=True)
 
+# app.py re-runs on every interaction; the cache_resource wrapper makes this a no-op after the first
+ensure_data_dir()
+
 def get_chat_history_file():
     """Get the chat history file path for current session."""
     session_id = ensure_session()
     return CHAT_HISTORY_FILE_TEMPLATE.format(session_id=session_id)
 
+def _open_session_file(filepath, mode):
+    """
+    Open a file in the session folder. ensure_session already created the folder, so it is only
+    recreated if it has since been swept by cleanup_old_sessions while the session stayed open.
+    """
+    try:
+        return open(filepath, mode)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        return open(filepath, mode)
+
+def _history_record(entry):
+    """Serialize one chat entry as a JSON line (rendered HTML is a display cache, not persisted)."""
+    return json_dumps({k: v for k, v in entry.items() if k != 'html'}) + b'\n'
+
 def save_chat_history(chat_history):
-    """Save chat history to persistent storage (session-isolated, max 10 conversations)."""
-    ensure_data_dir()
+    """Rewrite persistent storage with the given history (session-isolated, max 10 conversations)."""
     filepath = get_chat_history_file()
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
     # Keep maximum 10 conversations, remove oldest if exceeded
     limited_history = chat_history[-10:] if len(chat_history) > 10 else chat_history
-    with open(filepath, 'w') as f:
-        json.dump(limited_history, f, indent=2)
+    # Write to a temp file and swap it in atomically so readers never see a half-written log
+    tmp_path = filepath + '.tmp'
+    with _open_session_file(tmp_path, 'wb') as f:
+        f.writelines(_history_record(entry) for entry in limited_history)
+    os.replace(tmp_path, filepath)
+    # Full rewrite: the incremental read offset no longer applies
+    with _history_cache_lock():
+        _history_cache().pop(filepath, None)
+
+def append_chat_entry(entry):
+    """Append a single conversation to persistent storage (one JSON line per turn)."""
+    filepath = get_chat_history_file()
+    with _open_session_file(filepath, 'ab') as f:
+        f.write(_history_record(entry))
+    compact_chat_history_if_due(filepath)
+
+def compact_chat_history_if_due(filepath):
+    """Once per interval, rewrite the append-only log keeping only the last 10 conversations."""
+    sentinel = os.path.join(os.path.dirname(filepath), ".last_compaction")
+    try:
+        if time.time() - os.path.getmtime(sentinel) < HISTORY_COMPACTION_INTERVAL:
+            return
+    except OSError:
+        # New log: start the interval now rather than rewriting a one-line file
+        with open(sentinel, 'a'):
+            pass
+        return
+    save_chat_history(load_chat_history())
+    os.utime(sentinel)
+
+@st.cache_resource
+def _history_cache():
+    """
+    Process-wide parsed-history cache: filepath -> {'mtime', 'offset', 'data'}.
+    Least recently used files are evicted beyond HISTORY_CACHE_MAX_FILES.
+    Shared by every session's script thread; only touch it while holding _history_cache_lock().
+    """
+    return OrderedDict()
+
+@st.cache_resource
+def _history_cache_lock():
+    """Lock guarding _history_cache() across concurrent sessions."""
+    return threading.Lock()
+
+def _read_last_history_lines(filepath, count=10):
+    """
+    Parse the last `count` complete lines of a JSONL log by scanning backwards through an mmap,
+    so a cold load touches only the tail of the file. Returns (entries, end offset of last line).
+    """
+    with open(filepath, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return [], 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Ignore a partially written last line; it is picked up on a later read
+            end = mm.rfind(b'\n') + 1
+            entries = []
+            newline = end - 1
+            while newline > 0 and len(entries) < count:
+                start = mm.rfind(b'\n', 0, newline) + 1
+                try:
+                    entries.append(json_loads(mm[start:newline]))
+                except ValueError:
+                    pass
+                newline = start - 1
+    entries.reverse()
+    return entries, end
 
 def load_chat_history():
-    """Load chat history from persistent storage (session-isolated)."""
-    ensure_data_dir()
+    """
+    Load chat history from persistent storage (session-isolated, last 10 conversations).
+    Parsed entries are cached per file; only lines appended since the last read are parsed.
+    """
     filepath = get_chat_history_file()
-    if os.path.exists(filepath):
-        try:
-            with open(filepath, 'r') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+    try:
+        mtime = os.path.getmtime(filepath)
+    except OSError:
+        return []
+    with _history_cache_lock():
+        cache = _history_cache()
+        cached = cache.get(filepath)
+        if cached is None or os.path.getsize(filepath) < cached['offset']:
+            # First read, or the file was rewritten shorter: read just the tail of the log
+            data, offset = _read_last_history_lines(filepath)
+            # Bounded so appended lines push the oldest out; keeps the last 10 conversations
+            cached = cache[filepath] = {'mtime': mtime, 'offset': offset, 'data': deque(data, maxlen=10)}
+            while len(cache) > HISTORY_CACHE_MAX_FILES:
+                cache.popitem(last=False)
+        elif cached['mtime'] != mtime:
+            with open(filepath, 'rb') as f:
+                f.seek(cached['offset'])
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # Partially written last line; pick it up on a later read
+                        break
+                    cached['offset'] += len(line)
+                    try:
+                        cached['data'].append(json_loads(line))
+                    except ValueError:
+                        continue
+            cached['mtime'] = mtime
+        cache.move_to_end(filepath)
+        return [dict(entry) for entry in cached['data']]
 
 def cleanup_old_sessions(days=10):
     """Clean up sessions older than N days (keeps data uploaded for 10 days)."""
-    ensure_data_dir()
     cutoff_date = datetime.now() - timedelta(days=days)
     
     try:
@@ -73,57 +228,173 @@ def cleanup_old_sessions(days=10):
     except:
         pass
 
+def cleanup_old_sessions_if_due(days=10):
+    """Once per interval, sweep old sessions on the shared worker pool instead of on every rerun."""
+    try:
+        if time.time() - os.path.getmtime(CLEANUP_SENTINEL) < SESSION_CLEANUP_INTERVAL:
+            return
+    except OSError:
+        pass
+    # Touch before submitting so reruns in the meantime don't queue duplicate sweeps
+    with open(CLEANUP_SENTINEL, 'a'):
+        pass
+    os.utime(CLEANUP_SENTINEL)
+    run_in_background(cleanup_old_sessions, days)
+
+
+def render_qa_html(entry):
+    """Render one chat history entry as a collapsible HTML block (escaped, numbered via CSS counter)."""
+    user_time = entry.get('user_time', '')
+    bot_time = entry.get('bot_time', '')
+    question = entry['question'][:35] + "..." if len(entry['question']) > 35 else entry['question']
+    return (
+        f'<details class="qa-group">'
+        f'<summary>{html.escape(question)}</summary>'
+        f'<p><strong>❓ Question</strong> ({user_time[11:19]})</p>'
+        f'<blockquote>{html.escape(entry["question"])}</blockquote>'
+        f'<p><strong>✅ Answer</strong> ({bot_time[11:19]})</p>'
+        f'<blockquote>{html.escape(entry["answer"])}</blockquote>'
+        f'</details>'
+    )
+
+def render_history_html(entries, start=1):
+    """Join pre-rendered history entries (newest first), numbering them from start."""
+    for entry in entries:
+        # Entries loaded from disk are rendered on first display, then reused
+        if 'html' not in entry:
+            entry['html'] = render_qa_html(entry)
+    items = "".join(entry['html'] for entry in entries)
+    return f'<div class="qa-list" style="counter-reset: qa {start - 1};">{items}</div>'
 
-def get_cohere_response(question, context, cohere_api_key, model="command-a-03-2025"):
+def show_older_conversations():
+    """Button callback: render one more page of chat history."""
+    st.session_state['history_limit'] += HISTORY_PAGE_SIZE
+
+def get_docs_hash(docs):
+    """Stable content hash of the uploaded files, used as the cache key for processing."""
+    digest = hashlib.blake2b()
+    for doc in docs:
+        data = doc.getvalue()
+        # Extension and length frame each file, so moving bytes across a file boundary changes
+        # the hash; the name itself is left out so a renamed re-upload still hits the cache
+        ext = os.path.splitext(doc.name)[1].lower()
+        digest.update(b"\0" + ext.encode() + b"\0" + str(len(data)).encode() + b"\0")
+        digest.update(data)
+    return digest.hexdigest()
+
+def process_documents(docs_hash, docs, cohere_api_key):
+    """
+    Extract and chunk document text and build its index. Returns (num_chars, chunks, index_key),
+    where index_key is the hash of the chunks that keys build_index (None if there are none).
+    A repeat upload loads its chunk list from disk (keyed by the upload hash). For new files,
+    chunks are streamed into embedding batches as the text is extracted, so parsing later
+    files overlaps with the embed requests. The chunk list is only persisted when every file
+    was read without error, so a transient failure is retried on the next click.
+    """
+    chunks_path = os.path.join(INDEX_CACHE_DIR, f"{docs_hash}-{CHUNK_SIZE}-{CHUNK_OVERLAP}.chunks.json")
+    if os.path.exists(chunks_path):
+        with open(chunks_path, 'rb') as f:
+            cached = json_loads(f.read())
+        index_key = get_chunks_hash(cached["chunks"])
+        build_index(index_key, cached["chunks"], cohere_api_key)
+        return cached["num_chars"], cached["chunks"], index_key
+    
+    num_chars = 0
+    chunks = []
+    failures = []
+    
+    def texts():
+        nonlocal num_chars
+        for text in iter_document_text(docs, failures=failures):
+            num_chars += len(text)
+            yield text
+    
+    chunk_stream = iter_chunks(texts())
+    first = next(chunk_stream, None)
+    if first is None:
+        return num_chars, chunks, None
+    
+    def record(stream):
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+    
+    # Consumes the whole stream, filling chunks as it goes
+    index = get_faiss_index(record(itertools.chain([first], chunk_stream)), cohere_api_key, cache_dir=INDEX_CACHE_DIR)
+    index_key = get_chunks_hash(chunks)
+    # Share the index just built instead of loading it back from disk
+    build_index(index_key, chunks, cohere_api_key, _prebuilt=index)
+    if not failures:
+        os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+        
+        def write_chunks(path):
+            with open(path, 'wb') as f:
+                f.write(json_dumps({"num_chars": num_chars, "chunks": chunks}))
+        
+        write_atomically(chunks_path, write_chunks)
+    return num_chars, chunks, index_key
+
+@st.cache_resource(show_spinner=False)
+def build_index(index_key, _chunks, cohere_api_key, _prebuilt=None):
+    """
+    Build the FAISS index for a chunk list once and share it across sessions (cached per chunk hash,
+    so an index always matches the chunks it was built from). _prebuilt, if given, is cached as is.
+    """
+    if _prebuilt is not None:
+        return _prebuilt
+    return get_faiss_index(list(_chunks), cohere_api_key, cache_dir=INDEX_CACHE_DIR)
+
+
+def embed_question(question, client):
+    """
+    Embed the question (memoized per question). Returns (query_vec, user_time).
+    """
+    user_time = datetime.now().isoformat(timespec='seconds')
+    return embed_query(client, normalize_query(question)), user_time
+
+
+def reset_query_cache():
+    """Drop cached answers; they are only valid for the document they were asked about."""
+    st.session_state.query_cache_index = None
+    st.session_state.query_cache_answers = []
+
+
+def get_cohere_response(question, documents, cohere_api_key, model="command-a-03-2025", client=None):
     """
     Generate a response using Cohere's Chat API with RAG context.
     Uses command-a-03-2025 for optimal RAG performance.
+    Retrieved chunks are passed as chat documents rather than pasted into the message.
+    Yields the answer text incrementally as tokens arrive from the stream.
     """
-    co = cohere.Client(cohere_api_key)
+    co = client or get_cohere_client(cohere_api_key)
     
     # Validate inputs
     question = (question or "").strip()
-    context = (context or "").strip()
+    documents = [{"text": chunk} for chunk in documents or [] if chunk.strip()]
     
     if not question:
         raise ValueError("Empty question provided")
-    
-    # RAG system prompt - optimized for aggressive summarization
-    system_prompt = (
-        "You are an expert document analyst. SUMMARIZE your answer in 2-3 sentences maximum. "
-        "Based on the provided context, extract ONLY the most essential facts that directly answer the question. "
-        "Use bullet points if listing multiple items. Avoid explanations, examples, or redundant information. "
-        "Maximum 100 tokens - be extremely concise. "
-        "If the answer is not found, say 'Not available in document.'"
-    )
-    
-    # Build the RAG prompt with clear separation
-    rag_context = f"Document Context:\n{context}\n" if context else "No context available.\n"
+    if not documents:
+        # Without context the prompt can only produce the canned answer, so skip the round trip
+        yield NOT_IN_DOCUMENT_ANSWER
+        return
     
     try:
-        # Build the complete user message with context and question
-        user_message = f"{system_prompt}\n\n{rag_context}\nQuestion: {question}"
-        
-        # Use Cohere's chat method with RAG-optimized parameters
-        response = co.chat(
+        # Stream tokens from Cohere's chat endpoint with RAG-optimized parameters
+        stream = co.chat_stream(
             model=model,
-            message=user_message,
+            message=question,
+            preamble=RAG_SYSTEM_PROMPT,
             max_tokens=100,  # Aggressive summarization for concise answers
             temperature=0.2,  # Very low temp for focused factual responses
+            documents=documents,
         )
-        print(response)  # Debug: log full response object
-        # Extract text from response
-        if hasattr(response, "text"):
-            return response.text.strip()
-        elif isinstance(response, dict) and "text" in response:
-            return response["text"].strip()
-        elif hasattr(response, "message"):
-            if isinstance(response.message, dict) and "content" in response.message:
-                return response.message["content"].strip()
-            return str(response.message).strip()
-        else:
-            # Fallback for different response structures
-            return str(response).strip()
+        for event in stream:
+            if event.event_type == "text-generation":
+                yield event.text
+            elif event.event_type == "stream-end" and event.finish_reason not in ("COMPLETE", "MAX_TOKENS"):
+                # Surface failed generations instead of silently returning a partial answer
+                raise RuntimeError(f"generation stopped: {event.finish_reason}")
             
     except Exception as e:
         # Log error and raise with context
@@ -138,133 +409,54 @@ def main():
         initial_sidebar_state='auto'
     )
     
-    st.markdown('''
-        <style>
-        body, .stApp { background: #181c24 !important; }
-        .sticky-sidebar {
-            position: sticky;
-            top: 1.5rem;
-            max-height: 85vh;
-            overflow-y: auto;
-            overflow-x: hidden;
-            background: #23263a;
-            border-radius: 14px;
-            padding: 1rem 0.7rem 1rem 0.7rem;
-            box-shadow: 0 2px 12px 0 rgba(67,70,84,0.10);
-        }
-        .sticky-sidebar::-webkit-scrollbar {
-            width: 6px;
-        }
-        .sticky-sidebar::-webkit-scrollbar-track {
-            background: #1a1e28;
-            border-radius: 10px;
-        }
-        .sticky-sidebar::-webkit-scrollbar-thumb {
-            background: #4f8bf9;
-            border-radius: 10px;
-            border: 2px solid #23263a;
-        }
-        .sticky-sidebar::-webkit-scrollbar-thumb:hover {
-            background: #6fa0ff;
-        }
-        .qa-group {
-            background: #23263a;
-            border: 1.5px solid #434654;
-            border-radius: 14px;
-            padding: 0.7rem 0.9rem 0.7rem 0.9rem;
-            margin-bottom: 1.1rem;
-            transition: box-shadow 0.3s, background 0.3s;
-        }
-        .qa-group:hover {
-            background: linear-gradient(135deg, #23263a 60%, #434654 100%);
-            box-shadow: 0 6px 24px 0 rgba(79,139,249,0.18);
-            border-color: #4f8bf9;
-        }
-        .chat-msg {
-            margin-bottom: 1.1rem;
-            display: flex;
-            align-items: flex-start;
-            gap: 0.7rem;
-        }
-        .chat-avatar {
-            width: 36px;
-            height: 36px;
-            border-radius: 50%;
-            background: #ffe066;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            font-size: 1.3rem;
-            font-weight: bold;
-            color: #23263a;
-            flex-shrink: 0;
-            border: 2.5px solid #fff;
-            box-shadow: 0 2px 8px 0 rgba(255,224,102,0.10);
-            transition: border 0.3s, box-shadow 0.3s;
-        }
-        .chat-avatar-bot {
-            background: #4f8bf9;
-            color: #fff;
-            border: 2.5px solid #ffe066;
-            box-shadow: 0 2px 8px 0 rgba(79,139,249,0.10);
-        }
-        .chat-bubble {
-            background: #23263a;
-            color: #ffe066;
-            border-radius: 10px;
-            padding: 0.7rem 1rem;
-            font-size: 1rem;
-            font-weight: 500;
-            box-shadow: 0 1px 4px 0 rgba(67,70,84,0.10);
-            margin-bottom: 0.2rem;
-            max-width: 220px;
-            word-break: break-word;
-            transition: background 0.3s, color 0.3s;
-        }
-        .chat-bubble-bot {
-            background: #434654;
-            color: #fff;
-        }
-        .chat-timestamp {
-            font-size: 0.82rem;
-            color: #b0b0b0;
-            margin-top: 0.1rem;
-            margin-left: 2.5rem;
-        }
-        </style>
-    ''', unsafe_allow_html=True)
+    st.markdown(load_page_css(), unsafe_allow_html=True)
 
     # Initialize session (must be first for isolation)
     session_id = ensure_session()
+    ss = st.session_state
     
     # Initialize session state
-    if 'faiss_index' not in st.session_state:
-        st.session_state['faiss_index'] = None
-    if 'chunks' not in st.session_state:
-        st.session_state['chunks'] = None
-    if 'chat_history' not in st.session_state:
+    if 'index_key' not in ss:
+        # Key of the shared FAISS index in build_index's cache (the index itself is not per-session)
+        ss.index_key = None
+    if 'chunks' not in ss:
+        ss.chunks = None
+    if 'chat_history' not in ss:
         # Load last 10 conversations (max limit)
         all_history = load_chat_history()
-        st.session_state['chat_history'] = all_history[-10:] if len(all_history) > 10 else all_history
-    if 'document_loaded' not in st.session_state:
-        st.session_state['document_loaded'] = False
-    if 'current_response' not in st.session_state:
-        st.session_state['current_response'] = None
-    if 'current_question' not in st.session_state:
-        st.session_state['current_question'] = None
+        ss.chat_history = all_history[-10:] if len(all_history) > 10 else all_history
+        # Bumped on every change to chat_history; keys the cached history HTML
+        ss.history_version = ss.get('history_version', 0) + 1
+    if 'document_loaded' not in ss:
+        ss.document_loaded = False
+    if 'current_response' not in ss:
+        ss.current_response = None
+    if 'current_question' not in ss:
+        ss.current_question = None
+    if 'history_limit' not in ss:
+        ss.history_limit = HISTORY_PAGE_SIZE
+    if 'nprobe' not in ss:
+        # IVF cells probed per query (only used for very large corpora)
+        ss.nprobe = DEFAULT_NPROBE
+    if 'query_cache_index' not in ss:
+        # Semantic answer cache: embeddings of answered questions and their answers
+        reset_query_cache()
     
     # Cleanup old sessions (older than 10 days)
-    cleanup_old_sessions(days=10)
+    cleanup_old_sessions_if_due(days=10)
 
     if st.button("🧹 Clear Chat History"):
-        st.session_state['faiss_index'] = None
-        st.session_state['chunks'] = None
-        st.session_state['chat_history'] = []
-        st.session_state['document_loaded'] = False
+        ss.index_key = None
+        ss.chunks = None
+        ss.chat_history = []
+        ss.history_version += 1
+        ss.pop('history_render_key', None)
+        ss.pop('history_html', None)
+        ss.document_loaded = False
+        reset_query_cache()
         save_chat_history([])  # Clear persistent storage
-        message = st.success("Chat history cleared!", icon="✅")
-        time.sleep(2)
-        message.empty()
+        # Toasts dismiss themselves, so the rerun is not held up waiting to hide the message
+        st.toast("Chat history cleared!", icon="✅")
 
     # Sidebar: header, description, and document upload/processing
     with st.sidebar:
@@ -296,17 +488,19 @@ def main():
         if st.button("⚙️ Process Documents") and docs:
             with st.spinner("Processing documents..."):
                 try:
-                    raw_text = get_document_text(docs)
-                    if not raw_text.strip():
+                    docs_hash = get_docs_hash(docs)
+                    # Also builds the index on first processing, pipelined with extraction
+                    num_chars, chunks, index_key = process_documents(docs_hash, docs, cohere_api_key)
+                    if not chunks:
                         st.error("No text could be extracted from the documents")
                     else:
-                        chunks = get_chunked_text(raw_text)
-                        st.info(f"Created {len(chunks)} chunks from {len(raw_text)} characters")
+                        st.info(f"Created {len(chunks)} chunks from {num_chars} characters")
                         
-                        index, embeddings = get_faiss_index(chunks, cohere_api_key)
-                        st.session_state['faiss_index'] = index
-                        st.session_state['chunks'] = chunks
-                        st.session_state['document_loaded'] = True
+                        if ss.index_key != index_key:
+                            reset_query_cache()
+                        ss.index_key = index_key
+                        ss.chunks = chunks
+                        ss.document_loaded = True
                         st.success(f"✅ Documents processed! {len(chunks)} chunks indexed.")
                 except Exception as e:
                     st.error(f"❌ Error processing documents: {e}")
@@ -317,105 +511,118 @@ def main():
     with center:
         st.subheader("💬 Chat with Your Document")
         
-        # Initialize question key for clearing input
-        if 'question_key' not in st.session_state:
-            st.session_state['question_key'] = 0
+        # Set once the answer for this run has been streamed to the page
+        streamed = False
         
-        # Input box always visible (before and after upload)
-        question = st.text_input(
-            'Ask a question about your document:',
-            placeholder='Upload a document first to get started...' if not st.session_state['document_loaded'] else 'Type your question here...'
-        )
+        # Input box always visible (before and after upload); inside a form so the
+        # script only reruns on submit, and the input is cleared afterwards
+        with st.form("question_form", clear_on_submit=True):
+            question = st.text_input(
+                'Ask a question about your document:',
+                placeholder='Upload a document first to get started...' if not ss.document_loaded else 'Type your question here...'
+            )
+            submitted = st.form_submit_button("Ask")
         
-        if not st.session_state['document_loaded']:
+        if not ss.document_loaded:
             st.info("👈 Upload and process a document in the sidebar to get started")
-            # Show alert if user tries to type without uploading
-            if question:
+            # Show alert if user tries to ask without uploading
+            if submitted and question:
                 st.error("📄 ❌ Please upload and process a document first before asking questions!")
-        elif question:
-            # Only process if a NEW question is asked (different from current)
-            if question != st.session_state['current_question']:
-                st.session_state['current_question'] = question
+        elif submitted and question:
+            chunks = ss.chunks
+            # Cache hit: every session asking about this document shares one index in memory
+            index = build_index(ss.index_key, chunks, cohere_api_key)
+            # One client (and connection pool) for both the embed and the chat call
+            co = get_cohere_client(cohere_api_key)
+            ss.current_question = question
+            try:
                 with st.spinner("Thinking..."):
-                    try:
-                        # Retrieve top 3 relevant chunks
-                        top_chunks = search_faiss_index(
-                            st.session_state['faiss_index'],
-                            st.session_state['chunks'],
-                            question,
-                            cohere_api_key,
-                            top_k=3
+                    query_vec, user_time = embed_question(question, co)
+                    # A near-identical earlier question skips both retrieval and the LLM call
+                    cached_answer = lookup_cached_answer(ss.query_cache_index, ss.query_cache_answers, query_vec)
+                    if cached_answer is None:
+                        # Retrieve top 2 relevant chunks
+                        top_chunks, scores = search_faiss_index(
+                            index, chunks, question, cohere_api_key,
+                            top_k=2, nprobe=ss.nprobe, client=co, query_vec=query_vec
                         )
-                        
-                        if not top_chunks:
-                            st.warning("No relevant content found in document")
-                            st.session_state['current_response'] = None
-                        else:
-                            context = "\n---\n".join(top_chunks)
-                            user_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                            
-                            # Generate response
-                            response = get_cohere_response(question, context, cohere_api_key)
-                            bot_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                            
-                            # Store response in session state
-                            st.session_state['current_response'] = {
-                                'text': response,
-                                'user_time': user_time,
-                                'bot_time': bot_time
-                            }
-                            
-                            # Add to history
-                            st.session_state['chat_history'].append({
-                                'question': question,
-                                'answer': response,
-                                'user_time': user_time,
-                                'bot_time': bot_time
-                            })
-                            # Save to persistent storage
-                            save_chat_history(st.session_state['chat_history'])
-                    
-                    except Exception as e:
-                        st.error(f"❌ Error generating response: {e}")
-                        st.session_state['current_response'] = None
+                
+                st.markdown("### Answer:")
+                if cached_answer is not None:
+                    response = cached_answer
+                    st.markdown(response)
+                elif not top_chunks or max(scores) < MIN_RELEVANCE_SCORE:
+                    # Nothing in the document is close enough; answer without calling the LLM
+                    response = NOT_IN_DOCUMENT_ANSWER
+                    st.markdown(response)
+                else:
+                    # Stream response into the answer area as tokens arrive
+                    response = st.write_stream(
+                        get_cohere_response(question, top_chunks, cohere_api_key, client=co)
+                    ).strip()
+                if cached_answer is None:
+                    ss.query_cache_index = cache_answer(
+                        ss.query_cache_index, ss.query_cache_answers, query_vec, response
+                    )
+                streamed = True
+                bot_time = datetime.now().isoformat(timespec='seconds')
+                
+                # Store response in session state
+                ss.current_response = {
+                    'text': response,
+                    'user_time': user_time,
+                    'bot_time': bot_time
+                }
+                
+                # Add to history, rendering its HTML once up front
+                entry = {
+                    'question': question,
+                    'answer': response,
+                    'user_time': user_time,
+                    'bot_time': bot_time
+                }
+                entry['html'] = render_qa_html(entry)
+                history = ss.chat_history
+                history.append(entry)
+                ss.history_version += 1
+                # Save to persistent storage (append only the new turn)
+                append_chat_entry(entry)
         
+            except Exception as e:
+                st.error(f"❌ Error generating response: {e}")
+                ss.current_response = None
+
         # Display current response (stays until new output is generated)
-        if st.session_state['current_response']:
+        current_response = ss.current_response
+        if current_response and not streamed:
             st.markdown("### Answer:")
-            placeholder = st.empty()
-            typed = ""
-            for char in st.session_state['current_response']['text']:
-                typed += char
-                placeholder.markdown(typed)
-                time.sleep(0.01)
+            st.markdown(current_response['text'])
     
     with right:
-        st.markdown('<div class="sticky-sidebar">', unsafe_allow_html=True)
-        
         # Enforce max 10 conversations in session state as well
-        if len(st.session_state['chat_history']) > 10:
-            st.session_state['chat_history'] = st.session_state['chat_history'][-10:]
+        history = ss.chat_history
+        if len(history) > 10:
+            history = ss.chat_history = history[-10:]
+            ss.history_version += 1
         
-        st.subheader(f"📚 Chat History ({len(st.session_state['chat_history'])}/10)")
+        st.subheader(f"📚 Chat History ({len(history)}/10)")
         
-        if st.session_state['chat_history']:
-            # Display in reverse order (newest first) - max 10 items
-            for idx, entry in enumerate(reversed(st.session_state['chat_history'][:10]), 1):
-                user_time = entry.get('user_time', '')
-                bot_time = entry.get('bot_time', '')
-                question = entry['question'][:35] + "..." if len(entry['question']) > 35 else entry['question']
-                
-                # Compact expander format with correct numbering (newest = #1)
-                with st.expander(f"#{idx} · {question}", expanded=False):
-                    st.markdown(f'**❓ Question** ({user_time.split()[1]})')
-                    st.markdown(f"> {entry['question']}")
-                    
-                    st.markdown(f'**✅ Answer** ({bot_time.split()[1]})')
-                    st.markdown(f"> {entry['answer']}")
+        if history:
+            # Display in reverse order (newest first) - max 10 items, one page at a time
+            limit = ss.history_limit
+            # Reuse the joined HTML until an entry is added/evicted or another page is revealed
+            render_key = (ss.history_version, limit)
+            if ss.get('history_render_key') != render_key:
+                ss.history_render_key = render_key
+                ss.history_html = f'<div class="sticky-sidebar">{render_history_html(history[::-1][:limit])}</div>'
+            st.markdown(ss.history_html, unsafe_allow_html=True)
+            if len(history) > limit:
+                st.button(
+                    f"⬇️ Load older ({len(history) - limit} more)",
+                    on_click=show_older_conversations
+                )
         else:
             st.info('💬 No conversations yet. Ask a question to get started!')
-        
-        st.markdown('</div>', unsafe_allow_html=True)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,14 @@
+"""
+Worker-process side of parallel PDF extraction (see utils.extract_single).
+Kept separate from utils so worker processes only import pypdf, not Streamlit, FAISS or Cohere.
+"""
+from pypdf import PdfReader
+
+
+def extract_pdf_pages(path, start, stop):
+    """
+    Extract the text of pages [start, stop) of the PDF at path.
+    PdfReader resolves pages lazily, so only this range's page content is parsed.
+    """
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
@@ -1,144 +1,586 @@
 import cohere
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import httpx
+import itertools
+import multiprocessing
 import numpy as np
 import os
+import re
+import tempfile
+import threading
 from pypdf import PdfReader
 from docx import Document
 import streamlit as st
 import faiss
+import pdf_worker
 
 
-def get_document_text(files):
-    """Extract text from PDF and DOCX files."""
-    text = ""
-    for file in files:
+EMBED_MODEL = "embed-english-v3.0"
+
+# Optional: embed locally with sentence-transformers instead of calling the Cohere embed API
+USE_LOCAL_EMBEDDINGS = os.environ.get("USE_LOCAL_EMBEDDINGS", "").lower() in ("1", "true", "yes")
+LOCAL_EMBED_MODEL = "all-MiniLM-L6-v2"
+
+# Chunking: ~15% overlap, breaking at the coarsest boundary that fits
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 120
+CHUNK_SEPARATORS = ("\n\n", "\n", ". ", " ")
+
+# Maximum number of texts Cohere accepts per embed request, and concurrent embed requests
+EMBED_BATCH_SIZE = 96
+EMBED_WORKERS = 8
+
+# Bumped whenever the on-disk index layout changes so stale cached indexes are not reused
+INDEX_FORMAT = "ip-sq8-npy"
+
+# Documents with at least this many chunks use an HNSW graph index. Smaller ones are searched
+# exactly with one matrix-vector product over the embeddings, cached on disk as a plain .npy.
+# A modest efConstruction keeps builds fast; efSearch recovers recall at query time
+HNSW_MIN_CHUNKS = 2000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+
+# Corpora above this many chunks use a compressed IVF+PQ index
+IVFPQ_MIN_CHUNKS = 50000
+IVF_NLIST = 1024
+PQ_M = 16
+DEFAULT_NPROBE = 16
+
+# PDFs with at least this many pages are split across worker processes; pypdf is pure
+# Python, so threads would just take turns on the GIL
+PDF_PARALLEL_MIN_PAGES = 32
+PDF_WORKERS = os.cpu_count() or 1
+
+# Questions at least this similar (cosine) to an earlier one reuse its answer
+SEMANTIC_CACHE_THRESHOLD = 0.95
+
+# Shared worker pool for blocking network/FAISS calls; lives for the whole process
+# because Streamlit re-executes app.py (but not imported modules) on every rerun
+_EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+
+def run_in_background(fn, *args, **kwargs):
+    """Submit a blocking call to the shared worker pool and return its Future."""
+    return _EXECUTOR.submit(fn, *args, **kwargs)
+
+
+# One pooled HTTP/2 client shared by every Cohere client, so embed and chat calls reuse
+# connections and can be multiplexed over a single one
+_HTTP_CLIENT = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100, keepalive_expiry=30.0),
+    timeout=30.0,
+)
+
+
+# One client per API key for the life of the process. Only the (hashable) key is ever passed
+# through Streamlit caches; the client is resolved here, so st.cache_* never hashes it
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_cohere_client(cohere_api_key):
+    """
+    Return the process-wide Cohere client for the given API key, creating it on first use.
+    Reusing the client keeps its HTTP connection pool (keep-alive) warm across calls.
+    """
+    client = _CLIENTS.get(cohere_api_key)
+    if client is None:
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(cohere_api_key)
+            if client is None:
+                client = _CLIENTS[cohere_api_key] = cohere.Client(cohere_api_key, httpx_client=_HTTP_CLIENT)
+    return client
+
+
+# Process pool for PDF page extraction, started on first use
+_PDF_POOL = None
+_PDF_POOL_LOCK = threading.Lock()
+
+
+def _get_pdf_pool():
+    global _PDF_POOL
+    if _PDF_POOL is None:
+        with _PDF_POOL_LOCK:
+            if _PDF_POOL is None:
+                # Never fork the multithreaded server process: a lock held by another thread
+                # at fork time would deadlock the child. forkserver/spawn start clean workers
+                if "forkserver" in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context("forkserver")
+                    # Workers fork from a server that has already imported the (pypdf-only) worker
+                    context.set_forkserver_preload(["pdf_worker"])
+                else:
+                    context = multiprocessing.get_context("spawn")
+                _PDF_POOL = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=context)
+    return _PDF_POOL
+
+
+def _discard_pdf_pool(pool):
+    """Drop a pool whose worker died so the next large PDF starts a fresh one."""
+    global _PDF_POOL
+    with _PDF_POOL_LOCK:
+        if _PDF_POOL is pool:
+            _PDF_POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_pdf_pages_parallel(data, num_pages):
+    """
+    Extract every page's text, one contiguous page range per worker process.
+    The bytes are written to a temp file once and workers get only its path.
+    """
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        tmp.write(data)
+    try:
+        pool = _get_pdf_pool()
+        step = -(-num_pages // PDF_WORKERS)
         try:
-            if file.name.lower().endswith('.pdf'):
-                reader = PdfReader(file)
-                for page_num, page in enumerate(reader.pages):
-                    page_text = page.extract_text() or ""
-                    if page_text.strip():
-                        text += f"[Page {page_num + 1}]\n{page_text}\n"
-            elif file.name.lower().endswith('.docx'):
-                doc = Document(file)
-                for para in doc.paragraphs:
-                    if para.text.strip():
-                        text += para.text + "\n"
+            futures = [
+                pool.submit(pdf_worker.extract_pdf_pages, tmp.name, start, min(start + step, num_pages))
+                for start in range(0, num_pages, step)
+            ]
+            return [page_text for future in futures for page_text in future.result()]
+        except BrokenProcessPool:
+            _discard_pdf_pool(pool)
+            raise
+    finally:
+        os.remove(tmp.name)
+
+
+# Local embedding model, loaded on first use (only when USE_LOCAL_EMBEDDINGS is set)
+_LOCAL_EMBEDDER = None
+_LOCAL_EMBEDDER_LOCK = threading.Lock()
+
+
+def embed_local(texts):
+    """Embed texts with the local sentence-transformers model; returns L2-normalized float32 rows."""
+    global _LOCAL_EMBEDDER
+    if _LOCAL_EMBEDDER is None:
+        with _LOCAL_EMBEDDER_LOCK:
+            if _LOCAL_EMBEDDER is None:
+                from sentence_transformers import SentenceTransformer
+                _LOCAL_EMBEDDER = SentenceTransformer(LOCAL_EMBED_MODEL)
+    return _LOCAL_EMBEDDER.encode(
+        texts, batch_size=64, normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False
+    ).astype("float32", copy=False)
+
+
+def extract_single(file):
+    """
+    Extract text from one PDF or DOCX file.
+    Returns (text, message) where message is a warning/error to show, or None; it does not
+    call Streamlit itself so it can run in a worker thread.
+    """
+    # Collect pieces and join once; repeated += would copy the whole accumulator each time
+    parts = []
+    ext = os.path.splitext(file.name)[1].lower()
+    try:
+        if ext == '.pdf':
+            reader = PdfReader(file)
+            num_pages = len(reader.pages)
+            if num_pages >= PDF_PARALLEL_MIN_PAGES and PDF_WORKERS > 1:
+                try:
+                    page_texts = _extract_pdf_pages_parallel(file.getvalue(), num_pages)
+                except BrokenProcessPool:
+                    # A worker died (e.g. killed for memory); extract this file in-process instead
+                    page_texts = (page.extract_text() or "" for page in reader.pages)
             else:
-                st.warning(f"Unsupported file type: {file.name}")
-        except Exception as e:
-            st.error(f"Failed to read {file.name}: {e}")
-    return text
+                page_texts = (page.extract_text() or "" for page in reader.pages)
+            for page_num, page_text in enumerate(page_texts):
+                if page_text.strip():
+                    parts.append(f"[Page {page_num + 1}]\n{page_text}\n")
+        elif ext == '.docx':
+            doc = Document(file)
+            for para in doc.paragraphs:
+                if para.text.strip():
+                    parts.append(para.text + "\n")
+        else:
+            return "", ("warning", f"Unsupported file type: {file.name}")
+    except Exception as e:
+        return "".join(parts), ("error", f"Failed to read {file.name}: {e}")
+    return "".join(parts), None
 
 
-def get_chunked_text(text, chunk_size=600, chunk_overlap=300):
+def iter_document_text(files, failures=None):
     """
-    Split text into overlapping chunks for better RAG retrieval.
-    Uses 50% overlap (300/600) for better semantic context preservation.
+    Yield the extracted text of each file in upload order, as soon as it (and every file
+    before it) has been parsed. Files are parsed in parallel; warnings/errors are shown here.
+    Names of files that failed to read are appended to failures, if given.
     """
-    chunks = []
-    if not text or not text.strip():
-        return chunks
-    
-    # Split by sentences first for better semantic chunks
-    text = text.strip()
+    if not files:
+        return
+    with ThreadPoolExecutor(max_workers=min(8, len(files))) as executor:
+        for file, (text, message) in zip(files, executor.map(extract_single, files)):
+            if message:
+                level, message_text = message
+                (st.warning if level == "warning" else st.error)(message_text)
+                if level == "error" and failures is not None:
+                    failures.append(file.name)
+            yield text
+
+
+def get_document_text(files):
+    """Extract text from PDF and DOCX files, parsing files in parallel."""
+    return "".join(iter_document_text(files))
+
+
+def _separator_offsets(text, separators):
+    """
+    Sorted offsets just past every (possibly overlapping) occurrence of each separator,
+    found in one regex pass per separator.
+    """
+    return [
+        np.fromiter(
+            (m.start() + len(separator) for m in re.finditer(f"(?={re.escape(separator)})", text)),
+            dtype=np.int64
+        )
+        for separator in separators
+    ]
+
+
+def iter_chunks(texts, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, separators=CHUNK_SEPARATORS):
+    """
+    Split a stream of text pieces into overlapping chunks, yielding each chunk as soon as
+    enough text has arrived to place it. The chunks are the same as for the joined text:
+    each ends at the coarsest boundary available (paragraph, line, sentence, word),
+    and the next starts chunk_overlap characters before it ends.
+    """
+    buffer = ""
     start = 0
-    
-    while start < len(text):
-        end = min(start + chunk_size, len(text))
+    started = False
+    for piece in itertools.chain(texts, [None]):
+        final = piece is None
+        if final:
+            buffer = buffer.rstrip()
+            limit = len(buffer)
+        else:
+            buffer += piece
+        if not started:
+            # Leading whitespace of the whole text is dropped, as with text.strip()
+            buffer = buffer.lstrip()
+            started = bool(buffer)
+        if not final:
+            # Only place chunks known to end before the (stripped) end of the text
+            limit = len(buffer.rstrip())
+            if start + chunk_size >= limit:
+                continue
         
-        # Try to break at a logical boundary (sentence/paragraph)
-        if end < len(text):
-            # Look for last period or newline within the chunk
-            last_period = text.rfind(".", start, end)
-            last_newline = text.rfind("\n", start, end)
-            last_break = max(last_period, last_newline)
+        # Each chunk binary-searches these instead of rescanning the text
+        boundaries = _separator_offsets(buffer, separators)
+        while start < limit if final else start + chunk_size < limit:
+            end = min(start + chunk_size, limit)
             
-            if last_break > start + (chunk_size // 2):  # Only if it's not too early
-                end = last_break + 1
-        
-        chunk = text[start:end].strip()
-        if chunk:  # Only add non-empty chunks
-            chunks.append(chunk)
+            # Try to break at a logical boundary, preferring paragraphs over lines, sentences and words
+            if end < limit:
+                for separator, positions in zip(separators, boundaries):
+                    i = np.searchsorted(positions, end, side="right") - 1
+                    # Only if it's not too early
+                    if i >= 0 and positions[i] - len(separator) >= start + (chunk_size // 2):
+                        end = int(positions[i])
+                        break
+            
+            chunk = buffer[start:end].strip()
+            if chunk:  # Only add non-empty chunks
+                yield chunk
+            
+            if end >= limit:
+                break
+            start = max(end - chunk_overlap, start + 1)
         
-        start += chunk_size - chunk_overlap
-    
-    return chunks
+        # Keep only the text the next chunk can still start in
+        buffer = buffer[start:]
+        start = 0
+
 
+def get_chunked_text(text, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, separators=CHUNK_SEPARATORS):
+    """Split text into overlapping chunks for better RAG retrieval (see iter_chunks)."""
+    return list(iter_chunks([text or ""], chunk_size, chunk_overlap, separators))
 
-def get_faiss_index(chunks, cohere_api_key):
+
+# GPU resources for index offload, created on first use (only with a GPU build of FAISS)
+_GPU_RESOURCES = None
+_GPU_RESOURCES_LOCK = threading.Lock()
+
+
+def _to_gpu(index):
+    """
+    Move an index to the first GPU when FAISS was built with GPU support and one is visible.
+    Index types without a GPU implementation (HNSW, flat scalar quantizer) stay on the CPU.
+    """
+    global _GPU_RESOURCES
+    if not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+        return index
+    try:
+        if _GPU_RESOURCES is None:
+            with _GPU_RESOURCES_LOCK:
+                if _GPU_RESOURCES is None:
+                    _GPU_RESOURCES = faiss.StandardGpuResources()
+        return faiss.index_cpu_to_gpu(_GPU_RESOURCES, 0, index)
+    except RuntimeError:
+        return index
+
+
+def write_atomically(path, write):
+    """
+    Create path by calling write(tmp_path) on a temp file in the same directory, then
+    swapping it in with os.replace, so readers never see a partially written file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _save_npy(path, array):
+    # Through a file object: np.save would append ".npy" to a temp file name
+    with open(path, 'wb') as f:
+        np.save(f, array)
+
+
+def get_chunks_hash(chunks):
+    """Stable hash of the chunk list and embedding model, used to key cached indexes."""
+    model = LOCAL_EMBED_MODEL if USE_LOCAL_EMBEDDINGS else EMBED_MODEL
+    digest = hashlib.blake2b(f"{model}|{INDEX_FORMAT}".encode())
+    for chunk in chunks:
+        digest.update(b"\0" + chunk.encode())
+    return digest.hexdigest()
+
+
+def get_faiss_index(chunks, cohere_api_key, cache_dir=None):
     """
     Build FAISS index from document chunks using Cohere embeddings.
     Uses the latest embedding model for optimal performance.
+    If cache_dir is given, a previously built index for the same chunks is loaded from disk.
+    Returns only the searchable object, so compressed indexes are not held next to a full
+    float32 copy; for small documents it is the normalized embedding matrix itself, which
+    search_faiss_index scans with a single matmul.
+    chunks may also be an iterator (e.g. from iter_chunks): each batch is then sent for
+    embedding as soon as it fills, while the rest are still being produced. Its disk cache
+    entry is written afterwards but cannot be checked up front.
     """
-    if not chunks:
+    is_sequence = isinstance(chunks, (list, tuple))
+    if is_sequence and not chunks:
         raise ValueError("No chunks provided for indexing")
     
-    co = cohere.Client(cohere_api_key)
-    embeddings = []
+    cache_base = None
+    if cache_dir and is_sequence:
+        cache_base = os.path.join(cache_dir, get_chunks_hash(chunks))
+        if os.path.exists(cache_base + ".npy"):
+            # Small document: the exact normalized matrix, searched by matmul
+            return np.load(cache_base + ".npy")
+        if os.path.exists(cache_base + ".faiss"):
+            # For the IVF+PQ tier FAISS memory-maps the inverted lists, so they load on demand
+            # and are shared across processes through the page cache. HNSW indexes are still
+            # read fully into the heap; the flag has no effect on them. The vectors are not
+            # decoded back out, which would page in and copy every list
+            index = faiss.read_index(cache_base + ".faiss", faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            return _to_gpu(index)
+    
+    co = get_cohere_client(cohere_api_key)
+    
+    def embed_batch(texts):
+        if USE_LOCAL_EMBEDDINGS:
+            return embed_local(texts)
+        batch_resp = co.embed(
+            texts=texts,
+            model=EMBED_MODEL,
+            input_type="search_document",
+            embedding_types=["float"]
+        )
+        vectors = batch_resp.embeddings.float_
+        if not vectors:
+            raise ValueError("Failed to generate embeddings")
+        return vectors
     
     try:
         # Use v3 embedding model optimized for semantic search
-        # Process in batches for better performance
-        batch_size = 10
-        for i in range(0, len(chunks), batch_size):
-            batch = chunks[i:i + batch_size]
-            batch_resp = co.embed(
-                texts=batch,
-                model="embed-english-v3.0",
-                input_type="search_document"
-            )
-            embeddings.extend(batch_resp.embeddings)
+        # Process in batches of the API maximum, several requests in flight at once;
+        # each batch is written to its own row slice as soon as it lands, so order is kept
+        # Chunks are gathered into a list as they are batched; the input may be a one-shot iterator
+        chunk_iter = iter(chunks)
+        chunks = []
+        embeddings = None
+        # The local model already uses every core per batch, so it gets a single worker
+        workers = 1 if USE_LOCAL_EMBEDDINGS else EMBED_WORKERS
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for batch in iter(lambda: list(itertools.islice(chunk_iter, EMBED_BATCH_SIZE)), []):
+                futures[executor.submit(embed_batch, batch)] = len(chunks)
+                chunks.extend(batch)
+            if not chunks:
+                raise ValueError("No chunks provided for indexing")
+            for future in as_completed(futures):
+                start, vectors = futures[future], future.result()
+                if embeddings is None:
+                    # Every batch is submitted by now, so the row count is final; preallocate
+                    # once the dimension is known and copy each batch in exactly once
+                    embeddings = np.empty((len(chunks), len(vectors[0])), dtype="float32")
+                rows = embeddings[start:start + len(vectors)]
+                rows[:] = vectors
+                # L2-normalize the batch in place while later batches are still in flight,
+                # so inner product = cosine without another pass over the whole matrix
+                if not USE_LOCAL_EMBEDDINGS:
+                    faiss.normalize_L2(rows)
         
-        if not embeddings:
-            raise ValueError("Failed to generate embeddings")
+        if cache_dir and not is_sequence:
+            cache_base = os.path.join(cache_dir, get_chunks_hash(chunks))
+            if os.path.exists(cache_base + ".npy") or os.path.exists(cache_base + ".faiss"):
+                # Same chunks already cached under another upload; keep that file
+                cache_base = None
         
-        # Convert to numpy array for FAISS
-        embeddings = np.array(embeddings).astype("float32")
+        if len(chunks) < HNSW_MIN_CHUNKS:
+            # Exact search over the normalized matrix is cheaper than any index at this size.
+            # It is cached as-is (lossless) so scores are identical after a reload
+            if cache_base:
+                os.makedirs(cache_dir, exist_ok=True)
+                write_atomically(cache_base + ".npy", lambda path: _save_npy(path, embeddings))
+            return embeddings
         
         # Create FAISS index
         dimension = embeddings.shape[1]
-        index = faiss.IndexFlatL2(dimension)
+        if len(chunks) > IVFPQ_MIN_CHUNKS:
+            # Product quantization compresses each vector to PQ_M bytes; IVF probes only a few cells
+            quantizer = faiss.IndexFlatIP(dimension)
+            index = faiss.IndexIVFPQ(
+                quantizer, dimension, IVF_NLIST, PQ_M, 8, faiss.METRIC_INNER_PRODUCT
+            )
+            index.nprobe = DEFAULT_NPROBE
+        else:
+            # Graph-based approximate search scales sub-linearly for large documents;
+            # vectors are stored as 8-bit codes (one byte per dimension)
+            index = faiss.IndexHNSWSQ(
+                dimension, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT
+            )
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+        if not index.is_trained:
+            # Learns per-dimension ranges (SQ) or centroids and codebooks (IVF+PQ)
+            index.train(embeddings)
         index.add(embeddings)
         
-        return index, embeddings
+        if cache_base:
+            os.makedirs(cache_dir, exist_ok=True)
+            write_atomically(cache_base + ".faiss", lambda path: faiss.write_index(index, path))
+        
+        # Only the CPU copy is persisted; search runs on the GPU when one is available
+        return _to_gpu(index)
         
     except Exception as e:
         raise Exception(f"Error creating FAISS index: {str(e)}")
 
 
-def search_faiss_index(index, chunks, query, cohere_api_key, top_k=3):
+@functools.lru_cache(maxsize=512)
+def embed_query(co, query):
+    """
+    Embed a search query with the given Cohere client.
+    Memoized so repeated questions skip the embed API call; the vector is returned as a
+    tuple so callers cannot mutate the cached entry.
+    """
+    if USE_LOCAL_EMBEDDINGS:
+        return tuple(embed_local([query])[0].tolist())
+    query_resp = co.embed(
+        texts=[query],
+        model=EMBED_MODEL,
+        input_type="search_query"
+    )
+    if not query_resp.embeddings:
+        raise ValueError("Failed to embed query")
+    return tuple(query_resp.embeddings[0])
+
+
+def normalize_query(query):
+    """Collapse whitespace so trivially different spellings of a question share cache entries."""
+    return " ".join(query.split())
+
+
+def _query_matrix(query_vec):
+    """One-row float32 matrix holding the L2-normalized query embedding."""
+    query_emb = np.array([query_vec], dtype="float32")
+    faiss.normalize_L2(query_emb)
+    return query_emb
+
+
+def lookup_cached_answer(cache_index, answers, query_vec, threshold=SEMANTIC_CACHE_THRESHOLD):
+    """
+    Return the stored answer of the most similar earlier question if its cosine similarity
+    to query_vec is at least threshold, otherwise None.
+    """
+    if cache_index is None or cache_index.ntotal == 0:
+        return None
+    scores, ids = cache_index.search(_query_matrix(query_vec), 1)
+    if scores[0][0] >= threshold:
+        return answers[ids[0][0]]
+    return None
+
+
+def cache_answer(cache_index, answers, query_vec, answer):
+    """
+    Add a question embedding and its answer to the semantic cache.
+    Returns the cache index, creating it on first use.
+    """
+    query_emb = _query_matrix(query_vec)
+    if cache_index is None:
+        cache_index = faiss.IndexFlatIP(query_emb.shape[1])
+    cache_index.add(query_emb)
+    answers.append(answer)
+    return cache_index
+
+
+def search_faiss_index(index, chunks, query, cohere_api_key, top_k=3, nprobe=DEFAULT_NPROBE,
+                       client=None, query_vec=None):
     """
     Search FAISS index for relevant chunks using semantic similarity.
-    Returns the top-k most relevant chunks for RAG context.
+    Returns the top-k most relevant chunks for RAG context and their cosine similarity scores.
+    nprobe sets how many IVF cells are scanned (IVF indexes only).
+    An existing Cohere client can be passed to share its connection with the chat call,
+    and a precomputed query embedding (query_vec) skips the embed call entirely.
     """
     if not chunks or not query:
-        return []
+        return [], []
     
-    co = cohere.Client(cohere_api_key)
+    co = client or get_cohere_client(cohere_api_key)
     
     try:
-        # Embed the query with search_query input type
-        query_resp = co.embed(
-            texts=[query],
-            model="embed-english-v3.0",
-            input_type="search_query"
-        )
+        # Embed the query with search_query input type (normalized for cache hits)
+        if query_vec is None:
+            query_vec = embed_query(co, normalize_query(query))
+        query_emb = _query_matrix(query_vec)
         
-        if not query_resp.embeddings:
-            raise ValueError("Failed to embed query")
-        
-        query_emb = np.array(query_resp.embeddings).astype("float32")
-        
-        # Search FAISS index
-        distances, indices = index.search(query_emb, min(top_k, len(chunks)))
+        k = min(top_k, len(chunks))
+        if isinstance(index, np.ndarray):
+            # Small document: exact scores from one BLAS matrix-vector product, top-k by partition
+            all_scores = index @ query_emb[0]
+            top = np.argpartition(-all_scores, k - 1)[:k]
+            top = top[np.argsort(-all_scores[top])]
+            distances, indices = all_scores[top][None, :], top[None, :]
+        else:
+            # Search FAISS index. The index is shared by every session, so search settings
+            # go in per-call parameters instead of being set on the index
+            if hasattr(index, "hnsw"):
+                params = faiss.SearchParametersHNSW(efSearch=HNSW_EF_SEARCH)
+            elif hasattr(index, "nprobe"):
+                params = faiss.SearchParametersIVF(nprobe=nprobe)
+            else:
+                params = None
+            distances, indices = index.search(query_emb, k, params=params)
         
-        # Return chunks as a list, filtering out invalid indices
-        results = []
-        for idx in indices[0]:
+        # Return chunks and scores as lists, filtering out invalid indices
+        results, scores = [], []
+        for idx, score in zip(indices[0], distances[0]):
             if 0 <= idx < len(chunks):
                 results.append(chunks[idx])
+                scores.append(float(score))
         
-        return results
+        return results, scores
         
     except Exception as e:
         raise Exception(f"Error searching FAISS index: {str(e)}") 
\ No newline at end of file